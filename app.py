@@ -1,15 +1,26 @@
 import streamlit as st
-import pandas as pd
-from crewai import Agent, Task, Crew, Process
-from crewai_tools import SerperDevTool
-from langchain_community.llms import FakeListLLM 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import json
 import time
+import random
+import hashlib
+import sqlite3
+from contextlib import closing
 from datetime import datetime
 import re
 import sys
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:  # Optional speed-up; the stdlib json module is used when it is missing
+    orjson = None
 
 # --- Configuration & Deployment Check ---
 # Get API keys from Streamlit secrets
@@ -20,91 +31,179 @@ if not SERPER_API_KEY:
     st.error("❌ ERROR: SERPER_API_KEY not found in Streamlit secrets. Please set it to enable search.")
     st.stop()
 
+# --- Precompiled Patterns ---
+# Markers that mean a field was returned without real research data
+_PLACEHOLDER_RE = re.compile(r"not found|mock:", re.IGNORECASE)
+# Punctuation and symbols dropped when normalising company names; letters and digits of any script are kept
+_NON_WORD_RE = re.compile(r"[\W_]+")
+# Quota errors as raised by either LiteLLM or the google-genai client
+_RATE_LIMIT_RE = re.compile(r"ratelimit|resource_exhausted|\b429\b", re.IGNORECASE)
+
+# --- JSON Helpers ---
+def json_loads(raw):
+    """Decodes JSON text or bytes with orjson when installed, otherwise with the stdlib."""
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+_JSON_DECODER = json.JSONDecoder()
+
+def extract_json_object(text: str) -> dict:
+    """Decodes the first complete JSON object in text, ignoring code fences or prose around it.
+    
+    raw_decode stops as soon as that object closes, so trailing output is never scanned.
+    """
+    return _JSON_DECODER.raw_decode(text, text.index('{'))[0]
+
+def json_dumps(obj) -> str:
+    """Encodes obj as compact JSON text with orjson when installed, otherwise with the stdlib."""
+    return orjson.dumps(obj).decode("utf-8") if orjson else json.dumps(obj)
+
+def json_dumps_pretty(obj):
+    """Encodes obj as indented JSON (bytes with orjson, str with the stdlib)."""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2) if orjson else json.dumps(obj, indent=2)
+
 # --- Output Schema (Must match the required columns) ---
 class CompanyData(BaseModel):
+    """Lead profile for one company. Every text field ends with its source URL."""
+    # Field descriptions are sent to the LLM with every prompt that includes the schema, so keep them terse
     # Basic Company Info
-    linkedin_url: str = Field(description="LinkedIn URL and source/confidence.")
-    company_website_url: str = Field(description="Official company website URL and source/confidence.")
-    industry_category: str = Field(description="Industry category and source.")
-    employee_count_linkedin: str = Field(description="Employee count range and source.")
-    headquarters_location: str = Field(description="Headquarters city, country, and source.")
-    revenue_source: str = Field(description="Revenue data point and specific source (ZoomInfo/Owler/Apollo/News).")
+    linkedin_url: str = Field(description="LinkedIn company page URL.")
+    company_website_url: str = Field(description="Official website URL.")
+    industry_category: str = Field(description="Industry category.")
+    employee_count_linkedin: str = Field(description="Employee count range.")
+    headquarters_location: str = Field(description="HQ city, country.")
+    revenue_source: str = Field(description="Revenue (ZoomInfo/Owler/Apollo/news).")
     
     # Core Research Fields
-    branch_network_count: str = Field(description="Number of branches/facilities mentioned online and source.")
-    expansion_news_12mo: str = Field(description="Summary of expansion news in the last 12 months and source link.")
-    digital_transformation_initiatives: str = Field(description="Details on smart infra or digital programs and source link.")
-    it_leadership_change: str = Field(description="Name and title of new CIO/CTO/Head of Infra if changed recently and source link.")
-    existing_network_vendors: str = Field(description="Mentioned network vendors or tech stack and source.")
-    wifi_lan_tender_found: str = Field(description="Yes/No and source link if a tender was found.")
-    iot_automation_edge_integration: str = Field(description="Details on IoT/Automation/Edge mentions and source link.")
-    cloud_adoption_gcc_setup: str = Field(description="Details on Cloud Adoption or Global Capability Centers (GCC) and source link.")
-    physical_infrastructure_signals: str = Field(description="Any physical infra signals (new office, factory etc) and source link.")
-    it_infra_budget_capex: str = Field(description="IT Infra Budget or Capex allocation details and source.")
+    branch_network_count: str = Field(description="Branch/facility count.")
+    expansion_news_12mo: str = Field(description="Expansion news, last 12 months.")
+    digital_transformation_initiatives: str = Field(description="Digital transformation / smart infra programs.")
+    it_leadership_change: str = Field(description="Recent CIO/CTO/Head of Infra change: name, title.")
+    existing_network_vendors: str = Field(description="Network vendors / tech stack.")
+    wifi_lan_tender_found: str = Field(description="Yes/No: recent Wi-Fi upgrade or LAN tender.")
+    iot_automation_edge_integration: str = Field(description="IoT / automation / edge mentions.")
+    cloud_adoption_gcc_setup: str = Field(description="Cloud adoption or GCC setup.")
+    physical_infrastructure_signals: str = Field(description="New offices, factories or other physical infra.")
+    it_infra_budget_capex: str = Field(description="IT infra budget / capex.")
     
     # Analysis Fields
-    why_relevant_to_syntel: str = Field(description="Why this company is a relevant lead for Syntel (based on all data).")
+    why_relevant_to_syntel: str = Field(description="Why this is a relevant Syntel lead.")
     # Intent Scoring: Since the Pydantic schema requires 'int', the LLM MUST output an integer (e.g., 0 if data is not found)
     # The conflicting instruction "Not Found (No Source)" for an integer field is now handled in the task description to prioritize the integer type.
-    intent_scoring: int = Field(description="Intent score 1-10 based on buying signals detected.") 
+    intent_scoring: int = Field(description="Intent score 1-10 from buying signals.") 
+
+def parse_company_data(result_text: str) -> CompanyData:
+    """Validates the formatter's output as CompanyData; raises ValueError (or IndexError) when it isn't usable."""
+    try:
+        # 1. Schema-constrained formatter output is bare JSON: parse and validate it in one pydantic-core pass
+        return CompanyData.model_validate_json(result_text)
+    except ValidationError:
+        # 2. Otherwise decode the first JSON object in the output (skipping code fences and any text
+        #    around it) and validate that against the Pydantic schema
+        return CompanyData.model_validate(extract_json_object(result_text))
+
+# Field groups shared by the Detailed View and the parallel research tasks
+FIELD_CATEGORIES = {
+    "Basic Company Info": [
+        "linkedin_url", "company_website_url", "industry_category",
+        "employee_count_linkedin", "headquarters_location", "revenue_source"
+    ],
+    "Core Business Intelligence": [
+        "branch_network_count", "expansion_news_12mo", "digital_transformation_initiatives",
+        "it_leadership_change", "existing_network_vendors", "wifi_lan_tender_found",
+        "iot_automation_edge_integration", "cloud_adoption_gcc_setup", 
+        "physical_infrastructure_signals", "it_infra_budget_capex"
+    ],
+    "Analysis & Scoring": [
+        "why_relevant_to_syntel", "intent_scoring"
+    ]
+}
+
+# Groups gathered by the research specialist; analysis fields are left to the validator
+RESEARCH_CATEGORIES = ["Basic Company Info", "Core Business Intelligence"]
+
+# Broad OR-combined Serper queries that cover several fields of a group in one call
+COMBINED_QUERIES = {
+    "Basic Company Info": '{company} company profile headquarters linkedin employees industry',
+    "Core Business Intelligence": '{company} (CIO OR CTO OR "IT director") ("tech stack" OR vendors OR "wi-fi upgrade" OR "LAN tender")',
+}
 
 # --- Helper Function for Custom Table Formatting ---
-def format_data_for_display(company_input: str, validated_data: CompanyData) -> pd.DataFrame:
-    """Transforms the Pydantic model into the specific 1-row table format requested by the user."""
-    data_dict = validated_data.dict()
-    
-    # Define the exact output column names and map them to the Pydantic fields
-    mapping = {
-        "Company Name": "company_name_placeholder", # Placeholder for direct input
-        "LinkedIn URL": "linkedin_url",
-        "Company Website URL": "company_website_url",
-        "Industry Category": "industry_category",
-        "Employee Count (LinkedIn)": "employee_count_linkedin",
-        "Headquarters (Location)": "headquarters_location",
-        "Revenue (ZoomInfo / Owler / Apollo)": "revenue_source",
-        "Branch Network / Facilities Count": "branch_network_count",
-        "Expansion News (Last 12 Months)": "expansion_news_12mo",
-        "Digital Transformation Initiatives / Smart Infra Programs": "digital_transformation_initiatives",
-        "IT Infrastructure Leadership Change (CIO / CTO / Head Infra)": "it_leadership_change",
-        "Existing Network Vendors / Tech Stack": "existing_network_vendors",
-        "Recent Wi-Fi Upgrade or LAN Tender Found": "wifi_lan_tender_found",
-        "IoT / Automation / Edge Integration Mentioned": "iot_automation_edge_integration",
-        "Cloud Adoption / GCC Setup": "cloud_adoption_gcc_setup",
-        "Physical Infrastructure Signals": "physical_infrastructure_signals",
-        "IT Infra Budget / Capex Allocation": "it_infra_budget_capex",
-        "Why Relevent to Syntel": "why_relevant_to_syntel",
-        "Intent scoring": "intent_scoring",
-    }
-    
-    # Create the single row of data
-    row_data = {}
-    for display_col, pydantic_field in mapping.items():
-        if display_col == "Company Name":
-            row_data[display_col] = company_input 
-        else:
-            # Handle the Intent Score specifically to ensure it's a string for display consistency
-            if pydantic_field == "intent_scoring":
-                 row_data[display_col] = str(data_dict.get(pydantic_field, "N/A"))
-            else:
-                 row_data[display_col] = data_dict.get(pydantic_field, "N/A")
-            
-    # Convert the single dictionary entry into a DataFrame with one row
-    df = pd.DataFrame([row_data])
+# Exact output column names mapped to the Pydantic fields, in report order
+DISPLAY_COLUMNS = {
+    "LinkedIn URL": "linkedin_url",
+    "Company Website URL": "company_website_url",
+    "Industry Category": "industry_category",
+    "Employee Count (LinkedIn)": "employee_count_linkedin",
+    "Headquarters (Location)": "headquarters_location",
+    "Revenue (ZoomInfo / Owler / Apollo)": "revenue_source",
+    "Branch Network / Facilities Count": "branch_network_count",
+    "Expansion News (Last 12 Months)": "expansion_news_12mo",
+    "Digital Transformation Initiatives / Smart Infra Programs": "digital_transformation_initiatives",
+    "IT Infrastructure Leadership Change (CIO / CTO / Head Infra)": "it_leadership_change",
+    "Existing Network Vendors / Tech Stack": "existing_network_vendors",
+    "Recent Wi-Fi Upgrade or LAN Tender Found": "wifi_lan_tender_found",
+    "IoT / Automation / Edge Integration Mentioned": "iot_automation_edge_integration",
+    "Cloud Adoption / GCC Setup": "cloud_adoption_gcc_setup",
+    "Physical Infrastructure Signals": "physical_infrastructure_signals",
+    "IT Infra Budget / Capex Allocation": "it_infra_budget_capex",
+    "Why Relevent to Syntel": "why_relevant_to_syntel",
+    "Intent scoring": "intent_scoring",
+}
+REPORT_COLUMNS = ["Company Name", *DISPLAY_COLUMNS]
+
+@st.cache_data(show_spinner=False)
+def format_data_for_display(company_input: str, data_dict: dict) -> "pd.DataFrame":
+    """Transforms the dumped CompanyData fields into the specific 1-row table format requested by the user.
+    
+    Cached on the company and data, so a saved report shown again on later reruns skips the rebuild.
+    """
+    import pandas as pd  # Only needed once a report is rendered; keeps app start-up light
+    
+    # Handle the Intent Score specifically to ensure it's a string for display consistency
+    data_dict = {**data_dict, "intent_scoring": str(data_dict.get("intent_scoring", "N/A"))}
+    
+    # Build the single row in one pass and hand it to pandas with the columns fixed up front
+    record = (company_input, *(data_dict.get(field, "N/A") for field in DISPLAY_COLUMNS.values()))
+    df = pd.DataFrame.from_records([record], columns=REPORT_COLUMNS)
     
     # Set the index to an empty string to remove the '0' row label
     df.index = ['']
     
     return df
 
+@st.cache_data(show_spinner=False)
+def build_table_exports(report_df: "pd.DataFrame") -> tuple:
+    """Serialises the report table to CSV and TSV bytes, cached on the table contents."""
+    csv_data = report_df.to_csv(index=False).encode('utf-8')
+    tsv_data = report_df.to_csv(index=False, sep='\t').encode('utf-8')
+    return csv_data, tsv_data
+
+def count_filled_fields(data_dict: dict) -> int:
+    """Counts the fields that hold real research data (not empty, 'Not Found' or mock values)."""
+    # Each value is stringified once and reused for both the blank check and the placeholder search
+    return sum(1 for value in data_dict.values() if value and (text := str(value).strip()) and not _PLACEHOLDER_RE.search(text))
+
 
 # --- LLM Initialization ---
+# Gemini free-tier request budget for the whole process; LLM calls only wait when it would be exceeded
+GEMINI_MAX_RPM = 15
+GEMINI_MODEL = "gemini/gemini-2.5-flash-lite"
+# The formatted CompanyData JSON needs about 1-2k output tokens; Gemini 2.5 counts any thinking tokens
+# against the same cap, so it is set with headroom
+FORMATTER_MAX_TOKENS = 4096
+
+@st.cache_resource
 def get_llm():
+    """Builds the LLM once per process; Streamlit replays the notice below on later reruns."""
     if GEMINI_API_KEY:
         st.info("Using Gemini 2.5 Flash-Lite for high-throughput live research.") 
-        return "gemini/gemini-2.5-flash-lite"
+        return GEMINI_MODEL
         
     else:
         st.warning("⚠️ WARNING: GEMINI_API_KEY not found. Using a mock LLM for demonstration (no actual research will occur).")
+        # langchain_community is slow to import and only needed for the mock LLM
+        from langchain_community.llms import FakeListLLM
+        
         # Ensure the mock data conforms to the schema exactly
         responses = [json.dumps(CompanyData(
             linkedin_url="Mock: [linkedin.com/company/mockco](https://linkedin.com/company/mockco)", 
@@ -125,77 +224,276 @@ def get_llm():
             it_infra_budget_capex="Mock: $10M Capex (2025)",
             why_relevant_to_syntel="Mock: Strong expansion and clear digital initiatives point to major IT infra needs.",
             intent_scoring=8 # Must be an integer for the mock
-        ).dict())] * 10
+        ).model_dump())] * 10
         return FakeListLLM(responses=responses)
 
+@st.cache_resource
+def get_formatter_llm():
+    """Deterministic, output-capped LLM for the formatter, which only reshapes validated data into JSON."""
+    if GEMINI_API_KEY:
+        from crewai import LLM
+        return LLM(model=GEMINI_MODEL, api_key=GEMINI_API_KEY, temperature=0, max_output_tokens=FORMATTER_MAX_TOKENS)
+    return get_llm()
+
+@st.cache_resource
+def get_gemini_rate_limiter():
+    """One GEMINI_MAX_RPM budget shared by every crew in the process, whichever session started it."""
+    from crewai.utilities.rpm_controller import RPMController
+    return RPMController(max_rpm=GEMINI_MAX_RPM)
+
 # Initialize LLM once
 llm = get_llm()
 
+# --- Search Tool ---
+@st.cache_resource
+def get_http_session():
+    """Process-wide keep-alive session so repeated Serper calls reuse pooled TLS connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset({"POST"})  # Serper searches are idempotent POSTs
+        )
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+    return session
+
+# Google search operators that only work in upper case
+SEARCH_OPERATORS = frozenset({"OR", "AND"})
+
+def normalise_search_query(query: str) -> str:
+    """Lower-cases a query and collapses its whitespace so near-duplicates share a cache entry.
+    
+    OR/AND are left upper case; Google treats lower-case ones as ordinary search words.
+    """
+    return " ".join(token if token in SEARCH_OPERATORS else token.lower() for token in query.split())
+
+# On-disk Serper responses survive app restarts, so common lookups don't spend quota again for a day
+SERPER_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".serper_cache.sqlite3")
+SERPER_CACHE_TTL = 24 * 60 * 60
+
+@st.cache_resource
+def init_serper_cache() -> str:
+    """Creates the on-disk Serper cache table once per process and returns the database path."""
+    with closing(sqlite3.connect(SERPER_CACHE_PATH)) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")  # Lets concurrent research threads read while one writes
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS serper_cache (key TEXT PRIMARY KEY, response BLOB NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        conn.commit()
+    return SERPER_CACHE_PATH
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def serper_request(search_url: str, payload: dict) -> dict:
+    """POST one Serper query; repeated queries are served from memory, then from the on-disk cache."""
+    cache_key = hashlib.sha1(f"{search_url}|{json.dumps(payload, sort_keys=True)}".encode("utf-8")).hexdigest()
+    with closing(sqlite3.connect(init_serper_cache(), timeout=5)) as conn:
+        row = conn.execute(
+            "SELECT response FROM serper_cache WHERE key = ? AND fetched_at > ?",
+            (cache_key, time.time() - SERPER_CACHE_TTL)
+        ).fetchone()
+    if row:
+        return json_loads(row[0])
+
+    # The cache connection is closed during the request so parallel crews aren't held up on the file
+    response = get_http_session().post(
+        search_url,
+        headers={"X-API-KEY": SERPER_API_KEY, "content-type": "application/json"},
+        json=payload,
+        timeout=(3, 10)  # Fail fast on connect; allow the search itself up to 10s
+    )
+    response.raise_for_status()
+    with closing(sqlite3.connect(init_serper_cache(), timeout=5)) as conn:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO serper_cache (key, response, fetched_at) VALUES (?, ?, ?)",
+                (cache_key, response.content, time.time())
+            )
+    return json_loads(response.content)
+
+def make_search_tool():
+    """Builds the Serper search tool; crewai_tools is imported here because it takes seconds to load."""
+    from crewai_tools import SerperDevTool
+
+    class PooledSerperDevTool(SerperDevTool):
+        """SerperDevTool that sends its requests through the shared pooled session and query cache."""
+
+        def _make_api_request(self, search_query: str, search_type: str) -> dict:
+            payload = {"q": normalise_search_query(search_query), "num": self.n_results}
+            if self.country:
+                payload["gl"] = self.country
+            if self.location:
+                payload["location"] = self.location
+            if self.locale:
+                payload["hl"] = self.locale
+
+            return serper_request(self._get_search_url(search_type), payload)
+
+    return PooledSerperDevTool()
+
+# Fields whose answer is usually the top search hit; they are looked up before kickoff and handed to the
+# research agent as hints to confirm. Each maps to (query template, text the link must contain, hosts to skip).
+PREFETCH_QUERIES = {
+    "linkedin_url": ("{company} site:linkedin.com/company", "linkedin.com/company", ()),
+    "company_website_url": (
+        "{company} official website", "",
+        ("linkedin.com", "wikipedia.org", "facebook.com", "crunchbase.com", "zoominfo.com", "bloomberg.com")
+    ),
+}
+SERPER_SEARCH_URL = "https://google.serper.dev/search"
+
+def prefetch_known_fields(company_name: str) -> dict:
+    """Fetches the PREFETCH_QUERIES fields concurrently and returns the ones whose top result matched.
+    
+    The prefetch is only a shortcut, so any failure just leaves that field to the research agent.
+    """
+    def top_link(query, must_contain, skip_hosts):
+        # Same payload shape as PooledSerperDevTool, so an agent repeating the query hits the cache
+        payload = {"q": normalise_search_query(query.format(company=company_name)), "num": 10}
+        for result in serper_request(SERPER_SEARCH_URL, payload).get("organic", []):
+            link = result.get("link", "")
+            if must_contain in link and not any(host in link for host in skip_hosts):
+                return link
+        return None
+
+    with ThreadPoolExecutor(max_workers=len(PREFETCH_QUERIES)) as prefetch_executor:
+        futures = {field: prefetch_executor.submit(top_link, *spec) for field, spec in PREFETCH_QUERIES.items()}
+
+    known_fields = {}
+    for field, future in futures.items():
+        try:
+            link = future.result()
+        except Exception:
+            continue  # Left for the research agent to find as usual
+        if link:
+            known_fields[field] = f"{link} (Source: Serper top result)"
+    return known_fields
+
 # --- Agents ---
-search_tool = SerperDevTool()
-
-research_specialist = Agent(
-    role='Business Intelligence Research Specialist',
-    goal="Conduct deep, targeted research to find specific business intelligence data with source URLs for all requested fields.",
-    backstory="Expert in business intelligence with 15+ years experience finding hard-to-locate corporate data. Specializes in identifying expansion news, IT infrastructure changes, and digital transformation initiatives. Known for meticulous source verification and comprehensive data collection.",
-    tools=[search_tool],
-    verbose=True,
-    allow_delegation=False,
-    llm=llm
-)
+# Upper bound on each searching agent's tool loop so a run can't keep searching once fields are filled
+MAX_AGENT_ITERATIONS = 15
 
-data_validator = Agent(
-    role='Data Quality & Enrichment Specialist',
-    goal="Review and enrich research data. Ensure ALL fields have meaningful data with proper sources and calculate accurate intent scoring.",
-    backstory="Data quality expert with background in business analytics and market intelligence. Excellent at identifying weak data points and finding additional sources to strengthen research. Specializes in intent signal detection and relevance analysis.",
-    tools=[search_tool],
-    verbose=True,
-    allow_delegation=False,
-    llm=llm
-)
+@st.cache_resource
+def get_agents():
+    """Builds the search tool and the three agents once per process instead of on every rerun."""
+    from crewai import Agent
+
+    search_tool = make_search_tool()
+
+    research_specialist = Agent(
+        role='Business Intelligence Researcher',
+        goal="Find each requested data point with its source URL.",
+        backstory="Veteran B2B analyst who finds hard-to-locate corporate and IT infrastructure data and always cites sources.",
+        tools=[search_tool],
+        verbose=True,
+        allow_delegation=False,
+        max_iter=MAX_AGENT_ITERATIONS,
+        llm=llm
+    )
+
+    data_validator = Agent(
+        role='Data Quality Reviewer',
+        goal="Fill gaps in the research, keep sources attached and score buying intent.",
+        backstory="Market-intelligence reviewer who spots weak data points, strengthens them and scores buying intent.",
+        tools=[search_tool],
+        verbose=True,
+        allow_delegation=False,
+        max_iter=MAX_AGENT_ITERATIONS,
+        llm=llm
+    )
+
+    formatter = Agent(
+        role='JSON Schema Formatter',
+        goal="Turn the research into the required JSON, keeping every source.",
+        backstory="Schema specialist who turns research notes into complete, valid JSON.",
+        verbose=True,
+        allow_delegation=False,
+        llm=get_formatter_llm()
+    )
+    
+    return research_specialist, data_validator, formatter
 
-formatter = Agent(
-    role='Data Formatting & Schema Specialist',
-    goal="Format validated research data into the exact JSON schema ensuring every field is populated with appropriate data and source citations.",
-    backstory="Technical data specialist with expertise in data formatting and schema compliance. Ensures all output meets specified standards and is ready for downstream processing. Meticulous about data structure and field completion.",
-    verbose=True,
-    allow_delegation=False,
-    llm=llm,
-    output_json=CompanyData 
-)
 
 # --- Research Tasks ---
-def create_research_tasks(company_name):
+def create_research_tasks(company_name, research_specialist, data_validator, formatter, known_fields=None, deep_validation=True):
+    from crewai import Task
     
-    research_task = Task(
-        description=f"""
-        CONDUCT COMPREHENSIVE RESEARCH FOR: {company_name}
+    known_fields = known_fields or {}
+    
+    # One research task per field group; async_execution lets the groups' searches run concurrently
+    research_tasks = []
+    for category in RESEARCH_CATEGORIES:
+        field_lines = "\n".join(
+            f"        - {field}: {CompanyData.model_fields[field].description}"
+            for field in FIELD_CATEGORIES[category] if field not in known_fields
+        )
+        known_lines = "\n".join(
+            f"        - {field}: {known_fields[field]}"
+            for field in FIELD_CATEGORIES[category] if field in known_fields
+        )
+        if known_lines:
+            field_lines += (
+                f"\n        LIKELY VALUES (top search results; keep each one only if it clearly belongs to {company_name}, "
+                f"otherwise research that field as well):\n{known_lines}"
+            )
+        search_strategy = ""
+        if category in COMBINED_QUERIES:
+            search_strategy = (
+                "\n        SEARCH STRATEGY: Start with one combined query such as "
+                f"{COMBINED_QUERIES[category].format(company=company_name)} and spread its results across the fields. "
+                "Only run narrower follow-up searches for fields that are still missing."
+            )
+        research_tasks.append(Task(
+            description=f"""
+        CONDUCT TARGETED RESEARCH FOR: {company_name}
+        FOCUS AREA: {category}
         --
-        Your task is to find a single, definitive data point and source URL for every field listed in the schema.
+        Your task is to find a single, definitive data point and source URL for each of these fields:
+{field_lines}{search_strategy}
         CRITICAL: Provide source URLs for every piece of information found. If information cannot be found, state 'Not Found (No Source)' and the search terms used.
+        STOP searching as soon as every field above has a sourced value or is marked 'Not Found (No Source)'.
         """,
-        agent=research_specialist,
-        expected_output="Comprehensive research notes with data for all fields and source URLs"
-    )
+            # Async tasks run on their own threads, and an agent's executor holds one task's conversation at a
+            # time, so each concurrent group gets its own copy of the researcher
+            agent=research_specialist.copy(),
+            expected_output=f"Research notes with data and source URLs for the {category} fields",
+            async_execution=True
+        ))
 
-    validation_task = Task(
-        description=f"""
-        VALIDATE AND ENRICH RESEARCH DATA FOR: {company_name}
-        --
-        Review the research notes and ensure every field is populated or clearly marked 'Not Found (No Source)'.
-        Calculate a final 'Intent Scoring' (1-10) based on all the buying signals detected. If no data is found, set Intent Scoring to 0.
-        FINAL OUTPUT: Validated, enriched dataset ready for formatting.
-        """,
-        agent=data_validator,
-        expected_output="Validated dataset with quality scores and intent analysis"
-    )
+    # Fast path: without the deep validation pass the formatter scores the research notes directly
+    if not deep_validation:
+        analysis_step = (
+            "\n        Also write 'why_relevant_to_syntel' and calculate 'intent_scoring' (1-10) from the buying signals "
+            "in the research notes. If no data is found, set Intent Scoring to 0."
+        )
+    else:
+        analysis_step = ""
+        validation_task = Task(
+            description=f"""
+            VALIDATE AND ENRICH RESEARCH DATA FOR: {company_name}
+            --
+            Review the research notes and ensure every field is populated or clearly marked 'Not Found (No Source)'.
+            Only run new searches for fields that are missing or weakly sourced; keep fields that already have a source URL as they are.
+            Calculate a final 'Intent Scoring' (1-10) based on all the buying signals detected. If no data is found, set Intent Scoring to 0.
+            FINAL OUTPUT: Validated, enriched dataset ready for formatting.
+            """,
+            agent=data_validator,
+            expected_output="Validated dataset with quality scores and intent analysis",
+            context=research_tasks
+        )
 
     # CRITICAL: Added instruction to handle the integer field conflict by providing a default integer (0) if no score can be calculated.
     formatting_task = Task(
         description=f"""
         FORMAT FINAL OUTPUT FOR: {company_name}
         
-        Convert the validated research data into the exact JSON schema format defined by the Pydantic model.
+        Convert the validated research data into the exact JSON schema format defined by the Pydantic model.{analysis_step}
         
         REQUIREMENTS:
         - **EVERY SINGLE FIELD MUST BE PRESENT IN THE FINAL JSON.** If a field's value is truly 'Not Found', you must explicitly set its value to "Not Found (No Source)".
@@ -205,10 +503,415 @@ def create_research_tasks(company_name):
         Output must be valid JSON that can be parsed by the Pydantic model. **ONLY OUTPUT THE JSON STRING. DO NOT ADD ANY MARKDOWN, EXPLANATORY TEXT, OR BACKTICKS (```).**
         """,
         agent=formatter,
-        expected_output="Perfectly formatted JSON output matching the CompanyData schema"
+        expected_output="Perfectly formatted JSON output matching the CompanyData schema",
+        # Set on the task so CrewAI requests Gemini's schema-constrained JSON output for this tool-free step
+        output_json=CompanyData,
+        context=[validation_task] if deep_validation else research_tasks
+    )
+    
+    if deep_validation:
+        return [*research_tasks, validation_task, formatting_task]
+    return [*research_tasks, formatting_task]
+
+# --- Research Runner ---
+# Company research changes slowly, so a finished run is reused for a day
+RESEARCH_CACHE_TTL = 24 * 60 * 60
+# Rate-limited runs are retried with exponential backoff; after that, submissions pause for a cooldown
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF_SECONDS = 10
+RATE_LIMIT_COOLDOWN_SECONDS = 30
+# Finished runs are also kept on disk for a week, so they survive app restarts and redeploys
+RESEARCH_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".research_cache.sqlite3")
+RESEARCH_DISK_CACHE_TTL = 7 * 24 * 60 * 60
+
+@st.cache_resource
+def init_research_cache() -> str:
+    """Creates the on-disk research cache table once per process and returns the database path."""
+    with closing(sqlite3.connect(RESEARCH_CACHE_PATH)) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")  # Parallel research threads can read while one writes
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS research_cache (key TEXT PRIMARY KEY, result TEXT NOT NULL, finished_at REAL NOT NULL)"
+        )
+        conn.commit()
+    return RESEARCH_CACHE_PATH
+
+def research_cache_key(company_key: str, llm_id: str, deep_validation: bool) -> str:
+    """On-disk cache key; made of the same inputs as run_research's in-memory cache key."""
+    return f"{company_key}|{llm_id}|{int(deep_validation)}"
+
+def load_cached_research(cache_key: str):
+    """Returns a finished run's raw output from disk, or None when it is missing or older than the TTL."""
+    with closing(sqlite3.connect(init_research_cache(), timeout=5)) as conn:
+        row = conn.execute(
+            "SELECT result FROM research_cache WHERE key = ? AND finished_at > ?",
+            (cache_key, time.time() - RESEARCH_DISK_CACHE_TTL)
+        ).fetchone()
+    return row[0] if row else None
+
+def store_cached_research(cache_key: str, result: str):
+    """Saves a finished run's raw output to disk."""
+    with closing(sqlite3.connect(init_research_cache(), timeout=5)) as conn:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO research_cache (key, result, finished_at) VALUES (?, ?, ?)",
+                (cache_key, result, time.time())
+            )
+
+def clear_cached_research(cache_key: str):
+    """Drops one run from the on-disk cache so the next lookup researches it again."""
+    with closing(sqlite3.connect(init_research_cache(), timeout=5)) as conn:
+        with conn:
+            conn.execute("DELETE FROM research_cache WHERE key = ?", (cache_key,))
+
+class FormatterOutputError(ValueError):
+    """The crew finished, but its formatter output doesn't parse as CompanyData."""
+    def __init__(self, message: str, raw_output: str):
+        super().__init__(message)
+        self.raw_output = raw_output
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True when an exception is a Gemini quota / rate-limit failure."""
+    return _RATE_LIMIT_RE.search(f"{type(error).__name__} {error}") is not None
+
+@st.cache_data(ttl=RESEARCH_CACHE_TTL, show_spinner=False)
+def run_research(company_key: str, llm_id: str, deep_validation: bool, _company_name: str, _step_callback=None, _task_callback=None) -> str:
+    """Runs the crew for one company and returns the formatter's raw output.
+    
+    Cached on the normalised company name, the LLM in use and whether the validator ran, so repeat lookups
+    skip the crew entirely. Runs are cached in memory and, for RESEARCH_DISK_CACHE_TTL, on disk.
+    _step_callback and _task_callback, when given, receive every agent step and finished task as they happen;
+    neither is part of the cache key.
+    Raises FormatterOutputError when the output doesn't parse as CompanyData, so it is never cached.
+    """
+    disk_cache_key = research_cache_key(company_key, llm_id, deep_validation)
+    if (cached_result := load_cached_research(disk_cache_key)) is not None:
+        return cached_result
+    
+    from crewai import Crew, Process
+    
+    # Mock runs (no Gemini key) never use the hints, so they don't spend Serper quota on them
+    known_fields = prefetch_known_fields(_company_name) if GEMINI_API_KEY else {}
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        # Agents keep per-task executor state, so each run works on its own copies of the cached templates
+        research_specialist, data_validator, formatter = (agent.copy() for agent in get_agents())
+        research_tasks = create_research_tasks(
+            _company_name, research_specialist, data_validator, formatter, known_fields, deep_validation
+        )
+        # Every agent that runs a task, in task order: the researcher copies, then the validator and formatter
+        crew_agents = list({id(task.agent): task.agent for task in research_tasks}.values())
+        for agent in crew_agents:
+            # Crews from every session draw on one process-wide budget instead of a per-crew max_rpm
+            agent.set_rpm_controller(get_gemini_rate_limiter())
+        project_crew = Crew(
+            agents=crew_agents,
+            tasks=research_tasks,
+            process=Process.sequential,
+            step_callback=_step_callback,
+            task_callback=_task_callback,
+            verbose=1 
+        )
+        try:
+            # raw is the formatter's JSON text; str() of the output would give the parsed dict's repr instead
+            result = project_crew.kickoff().raw
+        except Exception as e:
+            if attempt == RATE_LIMIT_RETRIES or not is_rate_limit_error(e):
+                raise
+            # Searches from the failed attempt are cached, so a retry mostly re-spends LLM calls
+            time.sleep(RATE_LIMIT_BACKOFF_SECONDS * 2 ** attempt + random.uniform(0, 1))
+            continue
+        try:
+            parse_company_data(result)
+        except (ValueError, IndexError) as e:
+            # Raised rather than returned so neither cache layer keeps it and the next lookup runs the crew again
+            raise FormatterOutputError(f"{type(e).__name__} - {e}", result) from e
+        store_cached_research(disk_cache_key, result)
+        return result
+
+def describe_agent_step(step) -> str:
+    """One-line summary of a CrewAI agent step (a tool call or a final answer) for the live activity feed."""
+    if getattr(step, "tool", None):
+        return f"🔎 `{step.tool}`: {str(step.tool_input)[:200]}"
+    output = str(getattr(step, "output", step))
+    return f"✅ Step finished: {output[:200]}{'…' if len(output) > 200 else ''}"
+
+def stream_agent_steps(step_queue: queue.Queue, research_futures: dict, progress_bar, tasks_per_company: int):
+    """Yields summaries of the (company, kind, event) items arriving on step_queue, plus a note as each
+    company's run finishes, until every run is done and the queue is drained.
+    
+    Finished tasks also advance progress_bar, so it shows real progress across all companies' crews, along
+    with how many runs are still queued for a free research worker.
+    """
+    total_tasks = tasks_per_company * len(research_futures)
+    tasks_done = dict.fromkeys(research_futures.values(), 0)
+    queued_runs = 0
+    
+    def report_progress():
+        finished = sum(tasks_done.values())
+        queued_note = f" · {queued_runs} queued until a research worker is free" if queued_runs else ""
+        progress_bar.progress(finished / total_tasks, text=f"{finished}/{total_tasks} tasks finished{queued_note}")
+    
+    pending = dict(research_futures)
+    while pending or not step_queue.empty():
+        # The worker pool is shared by every session, so runs can wait behind other sessions' crews
+        now_queued = sum(1 for future in pending if not future.running() and not future.done())
+        if now_queued != queued_runs:
+            queued_runs = now_queued
+            report_progress()
+        for future in [future for future in pending if future.done()]:
+            company_name = pending.pop(future)
+            # Cached runs finish without reporting any tasks, so count the whole company as done
+            tasks_done[company_name] = tasks_per_company
+            report_progress()
+            yield f"🏁 Finished research for **{company_name}**\n\n"
+        try:
+            company_name, kind, event = step_queue.get(timeout=0.25)
+        except queue.Empty:
+            continue
+        if kind == "task":
+            # Capped because a rate-limit retry reports the same tasks again
+            tasks_done[company_name] = min(tasks_done[company_name] + 1, tasks_per_company)
+            report_progress()
+            yield f"**{company_name}** · 📌 Task finished: {event.summary}\n\n"
+        else:
+            yield f"**{company_name}** · {describe_agent_step(event)}\n\n"
+
+# Companies researched at the same time across all sessions; they share the Gemini budget, so more would only
+# wait on the rate limiter
+MAX_PARALLEL_COMPANIES = 3
+
+@st.cache_resource
+def get_research_executor() -> ThreadPoolExecutor:
+    """Process-wide worker pool for crew runs; it outlives reruns, so an interrupted script never waits on it."""
+    return ThreadPoolExecutor(max_workers=MAX_PARALLEL_COMPANIES, thread_name_prefix="research")
+
+# Trailing legal-form words that don't change which company is meant
+LEGAL_SUFFIXES = frozenset({
+    "inc", "incorporated", "corp", "corporation", "co", "company", "ltd", "limited",
+    "llc", "llp", "plc", "pvt", "private", "pte", "gmbh", "ag", "sa", "nv", "bv"
+})
+
+def company_cache_key(name: str) -> str:
+    """Normalises a company name so variants like "Infosys Ltd." and "infosys limited" share cached research."""
+    tokens = _NON_WORD_RE.sub(" ", name.casefold()).split()
+    while len(tokens) > 1 and tokens[-1] in LEGAL_SUFFIXES:
+        tokens.pop()
+    # A name made only of symbols still needs a key of its own rather than sharing the empty one
+    return " ".join(tokens) or name.strip().casefold()
+
+def parse_company_list(raw: str) -> list:
+    """Splits comma- or newline-separated company names, dropping blanks and repeats of the same company.
+    
+    A comma before a legal form ("Apple, Inc.") is part of the name, so that fragment rejoins the name before it.
+    """
+    names = []
+    for line in raw.splitlines():
+        line_names = []
+        for fragment in line.split(","):
+            fragment = fragment.strip()
+            tokens = _NON_WORD_RE.sub(" ", fragment.casefold()).split()
+            if tokens and all(token in LEGAL_SUFFIXES for token in tokens):
+                if line_names:  # A bare legal form with no name before it is not a company to research
+                    line_names[-1] = f"{line_names[-1]}, {fragment}"
+            elif fragment:
+                line_names.append(fragment)
+        names.extend(line_names)
+    
+    companies = {}
+    for name in names:
+        companies.setdefault(company_cache_key(name), name)
+    return list(companies.values())
+
+# --- Research History Store ---
+# History is kept on disk so it survives browser refreshes and app restarts
+HISTORY_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".research_history.sqlite3")
+MAX_HISTORY_ENTRIES = 50  # Only the newest entries are kept in the session and listed in the sidebar
+
+@st.cache_resource
+def init_history_db() -> str:
+    """Creates the history table once per process and returns the database path."""
+    with closing(sqlite3.connect(HISTORY_DB_PATH)) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")  # Sessions can load history while another session saves
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS research_history ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, company TEXT NOT NULL, timestamp TEXT NOT NULL, "
+            "data TEXT NOT NULL, intent INTEGER, filled_fields INTEGER, total_fields INTEGER)"
+        )
+        conn.commit()
+    return HISTORY_DB_PATH
+
+def load_research_history() -> deque:
+    """Reads the newest saved research summaries, oldest first, into a bounded deque.
+    
+    Summaries leave out the report data; load_research_data fetches it when a saved report is opened.
+    """
+    with closing(sqlite3.connect(init_history_db())) as conn:
+        rows = conn.execute(
+            "SELECT id, company, timestamp, intent, filled_fields, total_fields FROM research_history "
+            "ORDER BY id DESC LIMIT ?",
+            (MAX_HISTORY_ENTRIES,)
+        ).fetchall()
+    return deque(
+        (
+            {"id": entry_id, "company": company, "timestamp": timestamp, "intent": intent,
+             "filled_fields": filled_fields, "total_fields": total_fields}
+            for entry_id, company, timestamp, intent, filled_fields, total_fields in reversed(rows)
+        ),
+        maxlen=MAX_HISTORY_ENTRIES
     )
+
+def load_research_data(entry_id: int):
+    """Reads the report data of one saved research entry, or None if it has since been replaced."""
+    with closing(sqlite3.connect(init_history_db())) as conn:
+        row = conn.execute("SELECT data FROM research_history WHERE id = ?", (entry_id,)).fetchone()
+    return json_loads(row[0]) if row else None
+
+def history_key(entry: dict) -> tuple:
+    """History keeps one entry per company per day; this is the (company, date) pair that identifies it."""
+    return company_cache_key(entry["company"]), entry["timestamp"][:10]
+
+def save_research_entry(entry: dict) -> int:
+    """Saves one research entry to the on-disk history, replacing that company's entry from the same day,
+    and returns its id."""
+    entry_key = history_key(entry)
+    with closing(sqlite3.connect(init_history_db())) as conn:
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL keeps the file consistent; skip the per-commit fsync
+        with conn:
+            # A blank company key can't identify one company, so such entries are never replaced
+            if entry_key[0]:
+                same_day_rows = conn.execute(
+                    "SELECT id, company, timestamp FROM research_history WHERE substr(timestamp, 1, 10) = ?",
+                    (entry_key[1],)
+                ).fetchall()
+                conn.executemany(
+                    "DELETE FROM research_history WHERE id = ?",
+                    [(row_id,) for row_id, company, timestamp in same_day_rows
+                     if history_key({"company": company, "timestamp": timestamp}) == entry_key]
+                )
+            cursor = conn.execute(
+                "INSERT INTO research_history (company, timestamp, data, intent, filled_fields, total_fields) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (entry["company"], entry["timestamp"], json_dumps(entry["data"]), entry["intent"],
+                 entry["filled_fields"], entry["total_fields"])
+            )
+    return cursor.lastrowid
+
+# --- Result Rendering ---
+def render_research_result(company_name: str, result: str):
+    """Parses one company's crew output, records it in the history and renders its report tabs."""
+    # --- JSON Parsing Logic (Fixed for Extra Data Error) ---
+    try:
+        validated_data = parse_company_data(str(result))
+        
+        # Dump the model once; the history entry, report table, detailed view and JSON download all share it
+        entry_data = validated_data.model_dump()
+        research_entry = {
+            "company": company_name,
+            "timestamp": datetime.now().isoformat(),
+            "data": entry_data,
+            # Summary stats are stored once so the sidebar doesn't rescan the data on every rerun
+            "intent": validated_data.intent_scoring,
+            "filled_fields": count_filled_fields(entry_data),
+            "total_fields": len(entry_data)
+        }
+        research_entry["id"] = save_research_entry(research_entry)
+        # Re-researching a company on the same day replaces its earlier entry instead of adding another
+        history = st.session_state.research_history
+        entry_key = history_key(research_entry)
+        if entry_key[0]:
+            for stale_entry in [entry for entry in history if history_key(entry) == entry_key]:
+                history.remove(stale_entry)
+        # The session keeps only the summary; the data stays on disk until the saved report is loaded
+        history.append({key: value for key, value in research_entry.items() if key != "data"})
+        
+    except (ValueError, json.JSONDecodeError, IndexError, KeyError) as e:
+        # Catch the parsing and Pydantic validation errors
+        st.error(f"Error processing final results: {type(e).__name__} - {str(e)}")
+        st.write("Raw result of the last task (Formatter):")
+        st.code(result)
+        return
+    
+    render_report(company_name, validated_data, research_entry)
+
+def render_report(company_name: str, validated_data: CompanyData, research_entry: dict):
+    """Renders the report tabs for one research entry (freshly researched or loaded from history)."""
+    entry_data = research_entry["data"]
+    
+    # Build the report table once; the table tab and the downloads share it
+    final_df = format_data_for_display(company_name, entry_data)
     
-    return [research_task, validation_task, formatting_task]
+    # --- Display Tabs ---
+    tab1, tab2, tab3 = st.tabs(["📊 Final Report Table", "📋 Detailed View", "📈 Analysis Summary"])
+    
+    with tab1:
+        st.subheader(f"Final Business Intelligence Report for {company_name}")
+        
+        st.dataframe(final_df, use_container_width=True, height=200) 
+        
+        st.caption("The table can be scrolled horizontally to view all columns.")
+
+    with tab2:
+        st.subheader("Detailed Research Results")
+        
+        for category, fields in FIELD_CATEGORIES.items():
+            with st.expander(category, expanded=True):
+                # One markdown element per category instead of a markdown + divider pair per field
+                st.markdown("\n\n---\n\n".join(
+                    f"**{field.replace('_', ' ').title()}:** {entry_data[field]}"
+                    for field in fields if field in entry_data
+                ))
+    
+    with tab3:
+        st.subheader("Business Intelligence Analysis")
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Intent Score", f"{validated_data.intent_scoring}/10")
+        with col2:
+            completeness = (research_entry["filled_fields"] / research_entry["total_fields"]) * 100
+            st.metric("Data Completeness", f"{completeness:.1f}%")
+        with col3:
+            st.metric("Research Date", research_entry["timestamp"][:10])
+        
+        st.subheader("Relevance to Syntel")
+        st.info(validated_data.why_relevant_to_syntel)
+        
+        st.subheader("Download Options")
+        
+        file_stem = f"{company_name.replace(' ', '_')}_data"
+        # Widget keys use the cache key, which parse_company_list keeps unique within a submission;
+        # different names can share a file stem
+        widget_key = company_cache_key(company_name)
+        csv_data, tsv_data = build_table_exports(final_df)
+
+        # 1. Download JSON
+        json_filename = f"{file_stem}.json"
+        st.download_button(
+            label="Download JSON Data",
+            data=json_dumps_pretty(entry_data),
+            file_name=json_filename,
+            mime="application/json",
+            key=f"download_json_{widget_key}"
+        )
+
+        # 2. Download CSV
+        csv_filename = f"{file_stem}.csv"
+        st.download_button(
+            label="Download CSV Data",
+            data=csv_data,
+            file_name=csv_filename,
+            mime="text/csv",
+            key=f"download_csv_{widget_key}"
+        )
+
+        # 3. Download TSV (Tab Separated Values)
+        tsv_filename = f"{file_stem}.tsv"
+        st.download_button(
+            label="Download TSV Data",
+            data=tsv_data,
+            file_name=tsv_filename,
+            mime="text/tab-separated-values",
+            key=f"download_tsv_{widget_key}"
+        )
 
 # --- Streamlit UI ---
 st.set_page_config(
@@ -221,206 +924,171 @@ st.markdown("### Powered by CrewAI and Gemini/Serper Search")
 
 # Initialize session state
 if 'research_history' not in st.session_state:
-    st.session_state.research_history = []
+    st.session_state.research_history = load_research_history()
 if 'company_input' not in st.session_state:
     st.session_state.company_input = "Snowman Logistics"
+if 'rate_limited_until' not in st.session_state:
+    st.session_state.rate_limited_until = 0.0
+if 'pending_research' not in st.session_state:
+    st.session_state.pending_research = None  # In-flight research runs for this session
+if 'history_view' not in st.session_state:
+    st.session_state.history_view = None  # Summary entry of a saved report being shown
 
 # Input section
 col1, col2 = st.columns([2, 1])
 with col1:
-    company_input = st.text_input("Enter the company name to research:", st.session_state.company_input, key="company_input_widget")
+    company_input = st.text_area(
+        "Enter the company name(s) to research (one per line or comma-separated):",
+        st.session_state.company_input,
+        key="company_input_widget",
+        height=100
+    )
 with col2:
     with st.form("research_form"):
-        submitted = st.form_submit_button("Start Deep Research", type="primary")
+        deep_validation = st.checkbox(
+            "Deep validation pass (slower: a validator agent cross-checks and re-searches weak fields)", value=False
+        )
+        force_refresh = st.checkbox("Force refresh (ignore cached results)", value=False)
+        # Circuit breaker: after a run still hits the Gemini quota through its retries, hold new submissions briefly
+        cooldown_left = int(st.session_state.rate_limited_until - time.time())
+        submitted = st.form_submit_button("Start Deep Research", type="primary", disabled=cooldown_left > 0)
+        if cooldown_left > 0:
+            st.caption(f"Gemini rate limit reached; research can be started again in about {cooldown_left}s.")
 
 if submitted:
     st.session_state.company_input = company_input
+    st.session_state.history_view = None
+    companies = parse_company_list(company_input)
     
-    if not company_input:
+    if not companies:
         st.warning("Please enter a company name.")
         st.stop()
     else:
-        if isinstance(llm, FakeListLLM):
+        if not GEMINI_API_KEY:
               st.warning("Research is running with **Mock Data** (FakeListLLM). Please provide a **`GEMINI_API_KEY`** in Streamlit secrets for live results.")
-              time.sleep(1) 
 
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+        llm_id = llm if isinstance(llm, str) else "mock"
+        if force_refresh:
+            # Drop only these companies' cached runs so the crews below research them again
+            for name in companies:
+                run_research.clear(company_cache_key(name), llm_id, deep_validation, name)
+                clear_cached_research(research_cache_key(company_cache_key(name), llm_id, deep_validation))
         
-        with st.spinner(f"AI Agents are conducting deep research on **{company_input}**... This may take 2-3 minutes."):
-            try:
-                status_text.info("Phase 1/3: Initial research started...")
-                progress_bar.progress(20)
-                
-                tasks = create_research_tasks(company_input)
-                project_crew = Crew(
-                    agents=[research_specialist, data_validator, formatter],
-                    tasks=tasks,
-                    process=Process.sequential,
-                    verbose=1 
-                )
-                
-                status_text.info("Phase 2/3: Data validation and enrichment...")
-                progress_bar.progress(50)
-                
-                result = project_crew.kickoff()
-                
-                status_text.info("Phase 3/3: Final formatting...")
-                progress_bar.progress(80)
-                
-                progress_bar.progress(100)
-                status_text.success(f"Research Complete for {company_input}!")
-                
-                st.success(f"Comprehensive research completed for **{company_input}**")
-                
-                # --- JSON Parsing Logic (Fixed for Extra Data Error) ---
-                try:
-                    result_text = str(result)
-                    
-                    # 1. Clean the result: Strip markdown code fences
-                    cleaned_result = result_text.strip()
-                    if cleaned_result.startswith('```json'):
-                        cleaned_result = cleaned_result[7:]
-                    if cleaned_result.endswith('```'):
-                        cleaned_result = cleaned_result[:-3]
-                        
-                    # 2. Isolate the JSON string by finding the first '{' and the last '}'
-                    start_index = cleaned_result.index('{')
-                    # rindex is used to find the last occurrence of '}' to capture the whole object
-                    end_index = cleaned_result.rindex('}') + 1
-                    json_str = cleaned_result[start_index:end_index]
-                    
-                    # 3. Attempt to decode the JSON
-                    data = json.loads(json_str)
-                    
-                    # 4. Validate the final JSON against the Pydantic schema
-                    validated_data = CompanyData(**data) 
-                    
-                    research_entry = {
-                        "company": company_input,
-                        "timestamp": datetime.now().isoformat(),
-                        "data": validated_data.dict()
-                    }
-                    st.session_state.research_history.append(research_entry)
-                    
-                    # --- Display Tabs ---
-                    tab1, tab2, tab3 = st.tabs(["📊 Final Report Table", "📋 Detailed View", "📈 Analysis Summary"])
-                    
-                    with tab1:
-                        st.subheader(f"Final Business Intelligence Report for {company_input}")
-                        
-                        # Use the formatting function to get the desired single-row table
-                        final_df = format_data_for_display(company_input, validated_data)
-                        
-                        st.dataframe(final_df, use_container_width=True, height=200) 
-                        
-                        st.caption("The table can be scrolled horizontally to view all columns.")
-
-                    with tab2:
-                        st.subheader("Detailed Research Results")
-                        data_dict = validated_data.dict()
-                        
-                        categories = {
-                            "Basic Company Info": [
-                                "linkedin_url", "company_website_url", "industry_category",
-                                "employee_count_linkedin", "headquarters_location", "revenue_source"
-                            ],
-                            "Core Business Intelligence": [
-                                "branch_network_count", "expansion_news_12mo", "digital_transformation_initiatives",
-                                "it_leadership_change", "existing_network_vendors", "wifi_lan_tender_found",
-                                "iot_automation_edge_integration", "cloud_adoption_gcc_setup", 
-                                "physical_infrastructure_signals", "it_infra_budget_capex"
-                            ],
-                            "Analysis & Scoring": [
-                                "why_relevant_to_syntel", "intent_scoring"
-                            ]
-                        }
-                        
-                        for category, fields in categories.items():
-                            with st.expander(category, expanded=True):
-                                for field in fields:
-                                    if field in data_dict:
-                                        st.markdown(f"**{field.replace('_', ' ').title()}:** {data_dict[field]}")
-                                        st.divider()
-                    
-                    with tab3:
-                        st.subheader("Business Intelligence Analysis")
-                        
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("Intent Score", f"{validated_data.intent_scoring}/10")
-                        with col2:
-                            filled_fields = sum(1 for value in validated_data.dict().values() if value and str(value).strip() and "not found" not in str(value).lower() and "mock:" not in str(value).lower())
-                            total_fields = len(validated_data.dict())
-                            completeness = (filled_fields / total_fields) * 100
-                            st.metric("Data Completeness", f"{completeness:.1f}%")
-                        with col3:
-                            st.metric("Research Date", datetime.now().strftime("%Y-%m-%d"))
-                        
-                        st.subheader("Relevance to Syntel")
-                        st.info(validated_data.why_relevant_to_syntel)
-                        
-                        st.subheader("Download Options")
-                        
-                        # Generate the final DataFrame for download consistency
-                        final_df_download = format_data_for_display(company_input, validated_data)
-
-                        # 1. Download JSON
-                        json_filename = f"{company_input.replace(' ', '_')}_data.json"
-                        st.download_button(
-                            label="Download JSON Data",
-                            data=json.dumps(validated_data.dict(), indent=2),
-                            file_name=json_filename,
-                            mime="application/json"
-                        )
-
-                        # 2. Download CSV
-                        csv_data = final_df_download.to_csv(index=False).encode('utf-8')
-                        csv_filename = f"{company_input.replace(' ', '_')}_data.csv"
-                        st.download_button(
-                            label="Download CSV Data",
-                            data=csv_data,
-                            file_name=csv_filename,
-                            mime="text/csv"
-                        )
-
-                        # 3. Download TSV (Tab Separated Values)
-                        tsv_data = final_df_download.to_csv(index=False, sep='\t').encode('utf-8')
-                        tsv_filename = f"{company_input.replace(' ', '_')}_data.tsv"
-                        st.download_button(
-                            label="Download TSV Data",
-                            data=tsv_data,
-                            file_name=tsv_filename,
-                            mime="text/tab-separated-values"
-                        )
-                        
-                except (ValueError, json.JSONDecodeError, IndexError, KeyError) as e:
-                    # Catch the parsing and Pydantic validation errors
-                    st.error(f"Error processing final results: {type(e).__name__} - {str(e)}")
-                    st.write("Raw result of the last task (Formatter):")
-                    st.code(result)
-                    
-            except Exception as e:
-                # Catch the core CrewAI kickoff errors
-                st.error(f"Research failed: {type(e).__name__} - {str(e)}")
-                st.markdown("""
-                **Common Issues:**
-                - Ensure **`SERPER_API_KEY`** is set in Streamlit secrets
-                - Ensure **`GEMINI_API_KEY`** is set in Streamlit secrets (for live research)
-                - Check your API quotas (run again if you see a RateLimitError)
-                """)
+        # Each company's crew runs on the shared research executor, overlapping their LLM and search latency.
+        # All crews share the process-wide Gemini rate limiter, so together they stay under GEMINI_MAX_RPM.
+        
+        # Agent steps from every crew are reported through one queue so the page shows live progress.
+        # The runs are kept in session state: a rerun mid-research (e.g. a sidebar click) re-attaches to them
+        # instead of waiting for the crews or starting them again.
+        step_queue = queue.Queue()
+        research_executor = get_research_executor()
+        st.session_state.pending_research = {
+            "companies": companies,
+            "step_queue": step_queue,
+            # Research tasks plus the formatter, and the validator when the deep pass is on
+            "tasks_per_company": len(RESEARCH_CATEGORIES) + (2 if deep_validation else 1),
+            "futures": {
+                research_executor.submit(
+                    run_research, company_cache_key(name), llm_id, deep_validation, name,
+                    lambda step, name=name: step_queue.put((name, "step", step)),
+                    lambda task_output, name=name: step_queue.put((name, "task", task_output))
+                ): name
+                for name in companies
+            }
+        }
+
+if st.session_state.pending_research:
+    pending = st.session_state.pending_research
+    companies, research_futures = pending["companies"], pending["futures"]
+    
+    # Single status slot: the crew call blocks, so intermediate phase updates would never be seen
+    status_text = st.empty()
+    company_list = ", ".join(companies)
+    
+    with st.spinner(f"AI Agents are conducting deep research on **{company_list}**... This may take 2-3 minutes."):
+        status_text.info("Researching field groups in parallel, then validating and formatting...")
+        progress_bar = st.progress(0.0, text="0 tasks finished")
+        with st.expander("Live agent activity", expanded=False):
+            st.write_stream(stream_agent_steps(
+                pending["step_queue"], research_futures, progress_bar, pending["tasks_per_company"]
+            ))
+        status_text.success(f"Comprehensive research completed for **{company_list}**")
+    
+    st.session_state.pending_research = None
+    for research_future, company_name in research_futures.items():
+        if len(companies) > 1:
+            st.header(company_name)
+        try:
+            result = research_future.result()
+        except FormatterOutputError as e:
+            st.error(f"Error processing final results: {e}")
+            st.write("Raw result of the last task (Formatter):")
+            st.code(e.raw_output)
+            continue
+        except Exception as e:
+            # Catch the core CrewAI kickoff errors; other companies' reports still render
+            if is_rate_limit_error(e):
+                st.session_state.rate_limited_until = time.time() + RATE_LIMIT_COOLDOWN_SECONDS
+            st.error(f"Research failed: {type(e).__name__} - {str(e)}")
+            st.markdown("""
+            **Common Issues:**
+            - Ensure **`SERPER_API_KEY`** is set in Streamlit secrets
+            - Ensure **`GEMINI_API_KEY`** is set in Streamlit secrets (for live research)
+            - Check your API quotas (run again if you see a RateLimitError)
+            """)
+            continue
+        
+        render_research_result(company_name, result)
+
+elif st.session_state.history_view is not None:
+    # Show a saved report straight from history; it was validated when first researched, so skip revalidation
+    history_entry = st.session_state.history_view
+    entry_data = load_research_data(history_entry["id"])
+    if entry_data is None:
+        # Another session re-researched this company the same day, which replaced this entry
+        st.warning(f"The saved research for **{history_entry['company']}** from {history_entry['timestamp'][:10]} no longer exists.")
+        if history_entry in st.session_state.research_history:
+            st.session_state.research_history.remove(history_entry)
+        st.session_state.history_view = None
+    else:
+        research_entry = {**history_entry, "data": entry_data}
+        st.info(f"Showing saved research for **{research_entry['company']}** from {research_entry['timestamp'][:10]}.")
+        render_report(research_entry['company'], CompanyData.model_construct(**research_entry['data']), research_entry)
 
 # --- Research History ---
+@st.fragment
+def render_research_history():
+    """Sidebar history table and picker; picking an entry reruns only this fragment, not the whole app."""
+    import pandas as pd
+    
+    st.header("Research History")
+    # Newest first; one table and one picker instead of an expander and a button per entry
+    history = list(reversed(st.session_state.research_history))
+    st.dataframe(
+        pd.DataFrame.from_records(
+            [
+                (research['company'], f"{research['intent']}/10",
+                 f"{research['filled_fields']}/{research['total_fields']}", research['timestamp'][:10])
+                for research in history
+            ],
+            columns=["Company", "Intent Score", "Fields Filled", "Date"]
+        ),
+        hide_index=True,
+        use_container_width=True
+    )
+    selected_index = st.selectbox(
+        "Previous research",
+        range(len(history)),
+        format_func=lambda i: f"{history[i]['company']} - {history[i]['timestamp'][:10]}"
+    )
+    if st.button("Load selected company", key="load_history"):
+        st.session_state.company_input = history[selected_index]['company'] 
+        st.session_state.history_view = history[selected_index]
+        st.rerun()  # Full-app rerun so the main area shows the saved report
+
 if st.session_state.research_history:
-    st.sidebar.header("Research History")
-    for i, research in enumerate(reversed(st.session_state.research_history)):
-        original_index = len(st.session_state.research_history) - 1 - i 
-        
-        with st.sidebar.expander(f"**{research['company']}** - {research['timestamp'][:10]}", expanded=False):
-            st.write(f"Intent Score: {research['data'].get('intent_scoring', 'N/A')}/10")
-            if st.button(f"Load {research['company']}", key=f"load_{original_index}"):
-                st.session_state.company_input = research['company'] 
-                st.rerun()
+    with st.sidebar:
+        render_research_history()
 
 # --- Instructions ---
 with st.sidebar.expander("Setup Instructions ⚙️"):
@@ -437,6 +1105,6 @@ with st.sidebar.expander("Setup Instructions ⚙️"):
 
     **How it works (using Gemini 2.5 Flash-Lite):**
     1.  **Research Specialist** uses SerperDevTool to find data with sources.
-    2.  **Data Validator** verifies, enriches information, and assigns an Intent Score.
-    3.  **Formatter** creates the structured Pydantic JSON output.
+    2.  **Data Validator** (optional, with **Deep validation pass** ticked) verifies, enriches information, and assigns an Intent Score.
+    3.  **Formatter** creates the structured Pydantic JSON output. In the default run, without the validator, it also writes the Syntel relevance note and assigns the Intent Score from the research notes.
     """)